@@ -1,10 +1,18 @@
 #! /usr/bin/env python3
 
 import argparse
+import gzip
+import hashlib
+import itertools
+import os
 import pickle
-from collections import defaultdict
+import queue
+import threading
+import zlib
+from collections import Counter, defaultdict
 import random
 from datetime import datetime
+from store import LRUCache, DiskDict
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-i", "--input", type=str, help="Input File with source data in CONLL-U format, where lemma would be read from", required=True)
@@ -12,11 +20,14 @@ parser.add_argument("-l", "--lang_scores", type=str, nargs='+', help="Input file
 parser.add_argument("-a", "--alignments", type=str, nargs='+', help="Input file containing the alignments", required=True)
 parser.add_argument("-c", "--conllu", type=str, nargs='+', help="CONLLU files for the files in \'--alignments\' switch", required=True)
 parser.add_argument("-o", "--output", type=str, help="Output File with source data in CONLL-U format, tokenised. This is where predictions would be written", required=False)
-group = parser.add_mutually_exclusive_group(required=True)
+group = parser.add_mutually_exclusive_group(required=False)
 group.add_argument("--pickle", action='store_true', help="Save the pickles for the POS alignments and quit")
 group.add_argument("--already_pickled", type=str, nargs='+', help="Load the already pickled values, and continue from there.\n"
 																  "First argument should be sentence alignment\n"
 																  "Second argument should be word alignment.")
+group.add_argument("--screen", action='store_true', help="Estimate the alignment loss of each pair from a random sample of the sentences, and quit")
+group.add_argument("--shard", type=str, help="Run the next round of the map step for shard I of N, given as \'I/N\' (1 <= I <= N), and quit")
+group.add_argument("--reduce", type=int, help="Merge the count tables of the latest round of the map step for the given number of shards, and quit")
 parser.add_argument("-rf", "--random_fill", action='store_true', help="If true, selects one value at random in case of multiple possibilities.\n"
 																	  "Else, selects the best POS based on the lemma_based encountering of the tokens. \n"
 																	  "Default: False")
@@ -24,8 +35,29 @@ parser.add_argument("-f", "--lemma_based_decision", action='store_true',
 					help="If true, selects the best POS based on the lemma_based encountering of the tokens for unfilled values, later resorting to form-based POS tags.\n"
 						 "Else, selects the best POS based on just the form-based POS tags.\n"
 						 "Default: False")
+parser.add_argument("--resume", action='store_true', help="Continue from the latest checkpoint saved for the same inputs and arguments, instead of starting from the alignments")
+parser.add_argument("--sweep", type=str, choices=["grid", "random"], help="Try out the language weights over a grid, or at random, scoring each against the UPOS in \'-i (--input)\'.\n"
+																		 "The scores of \'-l (--lang_scores)\' are tried first. Exits after the sweep.")
+parser.add_argument("--sweep_size", type=int, default=10, help="For \'--sweep grid\', the number of steps for each weight. For \'--sweep random\', the number of weight vectors. Default: 10")
+parser.add_argument("--threshold", type=float, default=40, help="Loss (in %%) above which a pair is dropped, for \'--screen\'. Default: 40")
+parser.add_argument("--screen_batch", type=int, default=50, help="Number of sentences projected between the checks of the confidence interval, for \'--screen\'. Default: 50")
+parser.add_argument("--screen_max", type=int, default=2000, help="Maximum number of sentences projected for each pair, for \'--screen\'. Default: 2000")
+parser.add_argument("--pipeline", action='store_true', help="Run the reading, projection, voting and writing of the outputs as concurrent stages, linked by bounded queues")
+parser.add_argument("--queue_size", type=int, default=1000, help="Number of items each queue of \'--pipeline\' can hold. Default: 1000")
+parser.add_argument("--store", type=str, help="Directory for keeping the alignment and POS dictionaries on the disk, instead of the memory.\n"
+											  "Default: None, everything is kept in memory")
+parser.add_argument("--cache_mb", type=int, default=256, help="Memory budget (in MB) for the values of \'--store\' cached in memory. Default: 256")
 args = parser.parse_args()
 
+# z-value for the 95 % confidence intervals of '--screen'
+SCREEN_Z = 1.96
+# stages of tag_alignments() after which a checkpoint is saved, in order
+CHECKPOINT_STAGES = ["voted", "disambiguated", "part1", "part2"]
+# marks the end of the items in the queues of '--pipeline'
+PIPELINE_END = object()
+# rounds of the map step of '--shard', in order. Each round but the last is followed by a '--reduce'.
+SHARD_ROUNDS = ["voted", "disambiguated", "part1", "part2", "output"]
+
 
 # Routine checks with the arguments done here
 # calls normalize_scores()
@@ -111,6 +143,28 @@ def normalize_scores(score_list):
 	return score_list
 
 
+# returns an empty dict, stored on the disk in case of '--store' argument
+# if default_factory is given, works as a defaultdict
+# called by sentence_alignments(), word_alignments(), stored_alignments(), index_blocks(), tag_alignments(),
+# pos_encountered(), get_lemmas(), get_lemma_based_tags(), read_pickles()
+def new_dict(default_factory=None):
+	if args.store:
+		return DiskDict(args.store, cache, default_factory)
+	elif default_factory is None:
+		return dict()
+	else:
+		return defaultdict(default_factory)
+
+
+# returns a dict from new_dict() with the items of the given dict, emptying the given dict on the way
+# called in the main function, for '--already_pickled' with '--store'
+def move_to_store(values):
+	stored = new_dict()
+	for key in list(values):
+		stored[key] = values.pop(key)
+	return stored
+
+
 # converts the list of strings to a list of ints
 # called by word_alignments()
 def align_as_int(align_string):
@@ -126,7 +180,7 @@ def align_as_int(align_string):
 # Generates alignments at the sentence level, using the alignments file(s)
 # Used when generating pickles
 def sentence_alignments(alignment_file, fol):
-	sentences = dict()
+	sentences = new_dict()
 	parallel_data = alignment_file.split("/")[0] + "/" + fol + "-" + alignment_file.split("/")[1].split("_")[0]
 	ifile = open(parallel_data, "r", encoding="utf-8")
 	parallel_data = ifile.readlines()
@@ -152,10 +206,27 @@ def replace_tokens(int_list, phrases):
 	return val
 
 
-# Generates alignments at the sentence level, using the alignments file(s)
+# parses a triplet of lines from the alignments file, using the parallel data (as list of lines) for the sentences
+# returns the sentence of '-i (--input)' language, the corresponding source sentence, and the dict of [word] = [aligned source tokens]
 # calls align_as_int(), replace_tokens()
+# called by word_alignments(), read_alignments(), indexed_triplets(), screen_pair()
+def read_triplet(triplet, parallel_data):
+	words = dict()
+	source_sentence_number = int(triplet[0].strip("\n").split("(")[1].split(")")[0]) - 1
+	source, target = parallel_data[source_sentence_number].strip("\n").split("\t")
+	phrase = triplet[1].strip("\n").split()
+	tgt_list = triplet[2].strip("\n").split("})")
+	tgt_list = tgt_list[1:-1]
+	for z in tgt_list:
+		tgt, align = z.split(" ({ ")
+		words[tgt.strip(" ")] = replace_tokens(align_as_int(align), phrase)
+	return source, target, words
+
+
+# Generates alignments at the word level, using the alignments file(s)
+# calls read_triplet()
 def word_alignments(alignment_file, folder):
-	words_with_source = defaultdict(dict)
+	words_with_source = new_dict(dict)
 	
 	parallel_data = alignment_file.split("/")[0] + "/" + folder + "-" + alignment_file.split("/")[1].split("_")[0]
 	ifile = open(parallel_data, "r", encoding="utf-8")
@@ -163,47 +234,13 @@ def word_alignments(alignment_file, folder):
 	
 	with open(alignment_file, "r", encoding="utf-8") as a_file:
 		contents = a_file.readlines()
-		source = ""
-		phrase = ""
-		for i in range(len(contents)):
-			if i % 3 == 0:
-				words = dict()
-				source = ""
-				source_sentence_number = int(contents[i].strip("\n").split("(")[1].split(")")[0]) - 1
-				source = parallel_data[source_sentence_number].strip("\n").split("\t")[0]
-				words.clear()
-				phrase = ""
-			if i % 3 == 1:
-				phrase = contents[i].strip("\n").split()
-			if i % 3 == 2:
-				tgt_list = []
-				tgt_list = contents[i].strip("\n").split("})")
-				tgt_list = tgt_list[1:-1]
-				for z in tgt_list:
-					tgt, align = z.split(" ({ ")
-					words[tgt.strip(" ")] = replace_tokens(align_as_int(align), phrase)
-				words_with_source[source] = words
+		for i in range(0, len(contents) - 2, 3):
+			source, _, words = read_triplet(contents[i:i + 3], parallel_data)
+			words_with_source[source] = words
+	ifile.close()
 	return words_with_source
 
 
-# find the CONLLU-block that corresponds to the input_str in the contents of the CONLLU file (stored in file_contents)
-# called by get_projections()
-def find_str(input_str, file_contents):
-	contents = file_contents
-	val = []
-	for i in range(len(contents)):
-		lines = contents[i]
-		if lines != "\n":
-			if lines[:3] == "# t":
-				text, string = lines.strip("\n").split("# text = ")
-				if string == input_str:
-					j = i + 1
-					while contents[j] != "\n":
-						val.append(contents[j].strip("\n"))
-						j += 1
-					return val
-
-
 # replace the contents in original_list variable by a particular field from corresponding sentence stored in conllu_values_list.
 # calls return_field_conllu()
 # called by get_projections()
@@ -216,7 +253,7 @@ def align_POS_from_conllu(conllu_values_list, original_list):
 
 # Navigates in the ip_list to check_field_name field (str, case insensitive).
 # If the value of the field is same as check_field_value, the value in return_field_name is returned.
-# called by align_POS_from_conllu(), get_lemma_based_tags()
+# called by align_POS_from_conllu()
 def return_field_conllu(ip_list, check_field_name, check_field_value, return_field_name):
 	for i in ip_list:
 		if i[:2] != "# " and i != "\n":
@@ -238,7 +275,7 @@ def return_field_conllu(ip_list, check_field_name, check_field_value, return_fie
 
 
 # returns all the strings in the input conllu file
-# called by combine_projections()
+# called in the main function, for the occurrences of the sentences
 def return_strings():
 	val = []
 	with open(folder + "/" + folder + ".conllu", "r", encoding="utf-8") as conllu_file:
@@ -250,41 +287,274 @@ def return_strings():
 	return val
 
 
+# returns a dict of [sentence] = [token lines] for the first block of each of the wanted sentences in the conllu file
+# reads the file once, keeping only the wanted blocks, or all of them if wanted is None.
+# the blocks are kept in new_dict(), so that they are on the disk with '--store'.
+# called by get_projections(), pipelined_projections(), output_lines(), screen_pair()
+def index_blocks(conllu_file, wanted=None):
+	vals = new_dict()
+	with open(conllu_file, "r", encoding="utf-8") as infile:
+		sent = None
+		block = []
+		for lines in infile:
+			if lines == "\n":
+				if sent is not None and (wanted is None or sent in wanted) and sent not in vals:
+					vals[sent] = block
+				sent = None
+				block = []
+			elif lines[:3] == "# t" and sent is None:
+				sent = lines.strip("\n").split("# text = ")[1]
+			elif sent is not None and lines[:2] != "# ":
+				block.append(lines.strip("\n"))
+		if sent is not None and (wanted is None or sent in wanted) and sent not in vals:
+			vals[sent] = block
+	return vals
+
+
+# prints the hit rate of a memo, given the number of lookups and the number of values computed
+# called by output_lines()
+def report_memo(name, lookups, computed):
+	if lookups != 0:
+		print(name + " memo: " + str(lookups - computed) + " of " + str(lookups) + " lookups reused (" + str(round((lookups - computed) * 100 / lookups, 4)) + " % hit rate)")
+
+
+# returns the list of projected POS tags for each word in words, i.e. dict of [word] = [aligned source tokens]
+# calls align_POS_from_conllu()
+# called by get_projections(), pipelined_projections()
+def project_sentence(blocks, structure, words):
+	return [align_POS_from_conllu(blocks.get(structure), words[word]) for word in words]
+
+
 # does not affect first argument, modifies the second argument to now contain the projected POS tags, instead of projected tokens
-# calls find_str(), align_POS_from_conllu() as defined before
+# the repeated sentences of the input are projected once, since the alignments are keyed by the sentence.
+# the projections of a sentence are stored as a new dict, so that a store of '--store' measures their size again.
+# calls index_blocks(), project_sentence() as defined before
 def get_projections(sentence_alignments_dict, word_alignments_dict):
 	sentence_dict = sentence_alignments_dict
 	word_dict = word_alignments_dict
 	for i in range(len(word_dict)):
-		with open(folder + "/" + order[i] + ".conllu", "r", encoding="utf-8") as conllu_file:
-			file_contents = conllu_file.readlines()
-			for source_sent in word_dict[i]:
-				structure = find_str(sentence_dict[i][source_sent], file_contents)
-				for word in word_dict[i][source_sent]:
-					a = align_POS_from_conllu(structure, word_dict[i][source_sent][word])
-					word_dict[i][source_sent][word].clear()
-					word_dict[i][source_sent][word] = a
+		blocks = index_blocks(folder + "/" + order[i] + ".conllu", set(sentence_dict[i][j] for j in word_dict[i]))
+		for source_sent in word_dict[i]:
+			words = word_dict[i][source_sent]
+			word_dict[i][source_sent] = dict(zip(list(words), project_sentence(blocks, sentence_dict[i][source_sent], words)))
 	return sentence_dict, word_dict
 
 
-# calculates the scores for each POS candidate, attaching it as a string with the tag
-def set_scores(word_alignment_dict, score_dict, order_dict):
-	word_dict = word_alignment_dict
-	for i in range(len(word_dict)):
-		for sentence in word_dict[i]:
-			for words in word_dict[i][sentence]:
-				val = word_dict[i][sentence][words]
-				new_val = []
-				for values in val:
-					if values is not None:
-						if values != "_":
-							new_val.append(str(score_dict[order_dict[i]]) + "*" + values)
-				word_dict[i][sentence][words] = new_val
-	return word_dict
+# returns the index written by merge_parts.py beside the alignment file, or None if there is none.
+# an index not matching the sizes of the alignment file and the parallel data file is ignored.
+# called by read_alignments(), projection_targets(), screen_pair()
+def load_index(alignment_file, parallel_file):
+	if not os.path.exists(alignment_file + ".index"):
+		return None
+	with open(alignment_file + ".index", "rb") as infile:
+		index = pickle.load(infile)
+	if index["size"] != os.path.getsize(alignment_file) or index["parallel_size"] != os.path.getsize(parallel_file):
+		print("NOTE: \t" + alignment_file + ".index is out of date, and is not used.\n"
+			  "Run merge_parts.py again for the index.")
+		return None
+	return index
+
+
+# yields the triplets of the alignment file at the given positions, as parsed by read_triplet().
+# each triplet and its line of the parallel data are read by seeking to the offsets in the index.
+# if wanted is given, the triplets of the sentences not in wanted are skipped without being read.
+# calls read_triplet()
+# called by read_alignments(), screen_pair()
+def indexed_triplets(alignment_file, parallel_file, index, positions, wanted=None):
+	with open(alignment_file, "rb") as a_file, open(parallel_file, "rb") as p_file:
+		for k in positions:
+			number = index["sentences"][k]
+			p_file.seek(index["lines"][number - 1])
+			line = p_file.readline().decode("utf-8")
+			if wanted is not None and line.strip("\n").split("\t")[0] not in wanted:
+				continue
+			a_file.seek(index["offsets"][k])
+			triplet = [a_file.readline().decode("utf-8") for _ in range(3)]
+			yield read_triplet(triplet, {number - 1: line})
+
+
+# yields the triplets of the alignment file as parsed by read_triplet(), reading the file a triplet at a time
+# if wanted is given, only the triplets of the sentences in wanted are yielded.
+# with an index from merge_parts.py, the parallel data is not loaded in memory.
+# calls load_index(), indexed_triplets(), read_triplet()
+# called by pipelined_projections(), stored_alignments()
+def read_alignments(alignment_file, wanted=None):
+	parallel_file = alignment_file.split("/")[0] + "/" + folder + "-" + alignment_file.split("/")[1].split("_")[0]
+	index = load_index(alignment_file, parallel_file)
+	if index is not None:
+		yield from indexed_triplets(alignment_file, parallel_file, index, range(len(index["sentences"])), wanted)
+		return
+	with open(parallel_file, "r", encoding="utf-8") as ifile:
+		parallel_data = ifile.readlines()
+	with open(alignment_file, "r", encoding="utf-8") as a_file:
+		triplet = []
+		for lines in a_file:
+			triplet.append(lines)
+			if len(triplet) == 3:
+				source, target, words = read_triplet(triplet, parallel_data)
+				if wanted is None or source in wanted:
+					yield source, target, words
+				triplet = []
+
+
+# returns the sentence alignments and the word alignments of all the sources, in new_dict(), as lists in the order of
+# the alignment files. If wanted is given, only the alignments of the sentences in wanted are kept.
+# gives the same result as sentence_alignments() and word_alignments(), reading each file a triplet at a time.
+# calls read_alignments()
+# called by shard_projections(), and in the main function for '--store'
+def stored_alignments(wanted=None):
+	sentence_dict = []
+	word_dict = []
+	for i in args.alignments:
+		sentences = new_dict()
+		words_with_source = new_dict(dict)
+		for source, target, words in read_alignments(i, wanted):
+			sentences[source] = target
+			words_with_source[source] = words
+		sentence_dict.append(sentences)
+		word_dict.append(words_with_source)
+	return sentence_dict, word_dict
+
+
+# takes the items from inbox, passing the value returned by function for each to outbox (unless None, or outbox is None).
+# in case of an exception, it is recorded in errors, and the rest of the items are drained, so that no stage is blocked.
+# called by run_pipeline()
+def pipeline_stage(function, inbox, outbox, errors):
+	failed = False
+	while True:
+		item = inbox.get()
+		if item is PIPELINE_END:
+			break
+		if failed:
+			continue
+		try:
+			result = function(item)
+			if result is not None and outbox is not None:
+				outbox.put(result)
+		except Exception as e:
+			errors.append(e)
+			failed = True
+	if outbox is not None:
+		outbox.put(PIPELINE_END)
+
+
+# passes the items through the functions, each running in its own thread, linked by queues of '--queue_size'.
+# the items are read in the calling thread, so that reading overlaps with the rest of the stages.
+# the exceptions of the stages are raised again, once all the stages have finished.
+# calls pipeline_stage()
+# called by pipelined_projections(), tag_alignments(), write_pipelined_output()
+def run_pipeline(items, *functions):
+	queues = [queue.Queue(args.queue_size) for _ in functions]
+	errors = []
+	threads = []
+	for k in range(len(functions)):
+		outbox = queues[k + 1] if k + 1 < len(functions) else None
+		threads.append(threading.Thread(target=pipeline_stage, args=(functions[k], queues[k], outbox, errors)))
+	for t in threads:
+		t.start()
+	try:
+		for item in items:
+			queues[0].put(item)
+	finally:
+		queues[0].put(PIPELINE_END)
+		for t in threads:
+			t.join()
+	if len(errors) != 0:
+		raise errors[0]
+
+
+# returns the sentences of the source language needed for projecting the alignment file, i.e. the partners of all
+# its triplets, without reading the word alignments or keeping the file in memory.
+# every triplet is projected by pipelined_projections(), even if a later one for the same sentence replaces it.
+# the sentence numbers are taken from the index of merge_parts.py if there is one, else from the alignment file.
+# calls load_index()
+# called by pipelined_projections()
+def projection_targets(alignment_file):
+	parallel_file = alignment_file.split("/")[0] + "/" + folder + "-" + alignment_file.split("/")[1].split("_")[0]
+	index = load_index(alignment_file, parallel_file)
+	if index is not None:
+		needed = set(index["sentences"])
+	else:
+		needed = set()
+		with open(alignment_file, "r", encoding="utf-8") as a_file:
+			for i, lines in enumerate(a_file):
+				if i % 3 == 0:
+					needed.add(int(lines.strip("\n").split("(")[1].split(")")[0]))
+	targets = set()
+	with open(parallel_file, "r", encoding="utf-8") as ifile:
+		for number, lines in enumerate(ifile, 1):
+			if number in needed:
+				targets.add(lines.strip("\n").split("\t")[1])
+	return targets
+
+
+# generates the sentence alignments and the projected word alignments of all the sources with '--pipeline'.
+# for each source, the alignments are read, projected and stored in 3 stages, and the sources run concurrently.
+# gives the same result as sentence_alignments(), word_alignments() and get_projections()
+# as in get_projections(), only the blocks of the source conllu file needed for the projections are kept.
+# calls read_alignments(), projection_targets(), index_blocks(), project_sentence(), run_pipeline()
+def pipelined_projections():
+	sentence_dict = [new_dict() for _ in args.alignments]
+	word_dict = [new_dict(dict) for _ in args.alignments]
+	errors = []
+	
+	def run_source(i):
+		blocks = None
+		
+		def project(item):
+			nonlocal blocks
+			if blocks is None:
+				blocks = index_blocks(folder + "/" + order[i] + ".conllu", projection_targets(args.alignments[i]))
+			source, target, words = item
+			return source, target, dict(zip(list(words), project_sentence(blocks, target, words)))
+		
+		def store(item):
+			source, target, words = item
+			sentence_dict[i][source] = target
+			word_dict[i][source] = words
+		
+		try:
+			run_pipeline(read_alignments(args.alignments[i]), project, store)
+		except Exception as e:
+			errors.append(e)
+	
+	threads = [threading.Thread(target=run_source, args=(i,)) for i in range(len(args.alignments))]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	if len(errors) != 0:
+		raise errors[0]
+	return sentence_dict, word_dict
+
+
+# combines projections from different alignments into one, one target sentence at a time.
+# for each sentence of the input file (in occurrences), the projections of every source are looked up, and the scores
+# for each POS candidate are attached as a string with the tag, without modifying word_dict.
+# yields (target sentence, dict of [word] = [score*POS, ...]) in the order of the input file.
+# repeated sentences are combined once, at their first occurrence.
+# called by vote_alignments()
+def merge_projections(word_dict, score_dict, order_dict):
+	for target_sent in occurrences:
+		words = dict()
+		for word in target_sent.split():
+			words[word] = []
+		for i in range(len(word_dict)):
+			if target_sent not in word_dict[i]:
+				continue
+			projected = word_dict[i][target_sent]
+			score = score_dict[order_dict[i]]
+			for word in words:
+				if word in projected:
+					for values in projected[word]:
+						if values is not None:
+							if values != "_":
+								words[word].append(str(score) + "*" + values)
+		yield target_sent, words
 
 
 # combines the score metrics of the same POS tag, to give distinct POS tags, with updated scores.
-# called by combine_scores_dict_level()
+# called by tag_alignments()
 def combine_scores(POS_list_with_scores):
 	POS = dict()
 	vals = []
@@ -299,71 +569,47 @@ def combine_scores(POS_list_with_scores):
 	return vals
 
 
-# calls combine_scores() as defined above for each list
-def combine_scores_dict_level(alignments_dict):
-	al = alignments_dict
-	for sentences in al:
-		for words in al[sentences]:
-			al[sentences][words] = combine_scores(al[sentences][words])
-	return al
-
-
-# combines projections from different alignments into one
-# calls return_strings()
-def combine_projections(word_dict):
-	vals = defaultdict(dict)
-	for target_sent in return_strings():
-		words = dict()
-		for word in target_sent.split():
-			words[word] = []
-			for i in range(len(word_dict)):
-				if target_sent in word_dict[i]:
-					if word in word_dict[i][target_sent]:
-						words[word] += word_dict[i][target_sent][word]
-		vals[target_sent] = words
-	return vals
-
-
-# Input: alignment dict, with POS_value of a word in following format:
+# Input: dict of the words in a sentence, with POS_value of a word in following format:
 # [count1*value1, count2*value2, ...]			where counti is float in string, and valuei is pos_value
 # calculates the max value of counti, and in case the value is not shared by any other valuei, announces it as clear winner.
 # In case of max counti being shared by more than 1 valuei, copies the older list.
 # The ambiguity in latter case is resolved later in an another function.
-def decide_by_voting(alignments_dict_with_multiple_POS):
-	working_dict = alignments_dict_with_multiple_POS
-	for sentences in working_dict:
-		for words in working_dict[sentences]:
-			val = working_dict[sentences][words]
-			# if there are more than 1 items present, select a winner
-			if len(val) >= 2:
-				max = 0
-				max_val = ""
-				count = 0  # for keeping a tab on maximum values that share the current max_score
-				for items in val:
-					POS_val = items.split("*")[1]
-					POS_score = float(items.split("*")[0])
-					if POS_score > max:
-						max = POS_score
-						max_val = POS_val
-						count = 1
-					elif POS_score == max:
-						count += 1
-				# if only 1 pos_tag has max_score
-				if count == 1:
-					working_dict[sentences][words] = [max_val]
-			# else, do nothing
-			# if there is just one item beforehand
-			elif len(val) == 1:
-				working_dict[sentences][words] = [val[0].split("*")[1]]
+# called by tag_alignments()
+def decide_by_voting(words_with_multiple_POS):
+	working_dict = words_with_multiple_POS
+	for words in working_dict:
+		val = working_dict[words]
+		# if there are more than 1 items present, select a winner
+		if len(val) >= 2:
+			max = 0
+			max_val = ""
+			count = 0  # for keeping a tab on maximum values that share the current max_score
+			for items in val:
+				POS_val = items.split("*")[1]
+				POS_score = float(items.split("*")[0])
+				if POS_score > max:
+					max = POS_score
+					max_val = POS_val
+					count = 1
+				elif POS_score == max:
+					count += 1
+			# if only 1 pos_tag has max_score
+			if count == 1:
+				working_dict[words] = [max_val]
+		# else, do nothing
+		# if there is just one item beforehand
+		elif len(val) == 1:
+			working_dict[words] = [val[0].split("*")[1]]
 	return working_dict
 
 
 # takes in input the dict with alignments decided by voting
 # returns a nested defaultdict in format of [words][POS_encountered][count] for each word.
+# each sentence is counted as many times as it occurs in the input file.
 # refreshes our pos_dict
 # called by pos_encountered_disambiguation() to perform disambiguation
 def pos_encountered(alignments_with_voting):
-	POS = defaultdict(dict)
+	POS = new_dict(dict)
 	for sent in alignments_with_voting:
 		for words in alignments_with_voting[sent]:
 			val = alignments_with_voting[sent][words]
@@ -371,11 +617,11 @@ def pos_encountered(alignments_with_voting):
 			if len(val) == 1:
 				if words.lower() in POS:
 					if val[0] in POS[words.lower()]:
-						POS[words.lower()][val[0]] += 1
+						POS[words.lower()][val[0]] += occurrences[sent]
 					else:
-						POS[words.lower()][val[0]] = 1
+						POS[words.lower()][val[0]] = occurrences[sent]
 				else:
-					POS[words.lower()][val[0]] = 1
+					POS[words.lower()][val[0]] = occurrences[sent]
 	return POS
 
 
@@ -420,26 +666,47 @@ def remove_ambiguity(token, dict_with_pos):
 		return True, vals
 
 
+# adds the counts of the voted words of the sentence to pos_dict, as used by pos_encountered_disambiguation():
+# the decided POS, or each of the POS with maximal scores if undecided, counted as many times as the sentence occurs.
+# calls return_maximal()
+# called by vote_alignments(), map_shard()
+def count_voted_sentence(pos_dict, sent, voted_words):
+	for words in voted_words:
+		val = voted_words[words]
+		if len(val) == 1:
+			val2 = val
+		elif len(val) >= 2:
+			val2 = return_maximal(val)
+		else:
+			continue
+		for values in val2:
+			if values in pos_dict[words.lower()]:
+				pos_dict[words.lower()][values] += occurrences[sent]
+			else:
+				pos_dict[words.lower()][values] = occurrences[sent]
+
+
 # takes in input as the dict generated after voting.
 # calls pos_encountered() as defined above
-# creates a pos_dict with pos_encountered() + max_scores pos_values for the word
+# creates a pos_dict with pos_encountered() + max_scores pos_values for the word, unless given already
 # updates the input by adding all the updated_pos if there is a new clear winner.
 # tries to disambiguate the cases where pos_encountered() fails
 # calls pos_encountered(), return_maximal() and remove_ambiguity() as defined before.
-def pos_encountered_disambiguation(alignments_with_voting):
-	pos_dict = pos_encountered(alignments_with_voting)
-	
-	# update pos_dict by using max_scores from alignments.
-	for sent in alignments_with_voting:
-		for words in alignments_with_voting[sent]:
-			val = alignments_with_voting[sent][words]
-			if len(val) >= 2:
-				val2 = return_maximal(val)
-				for values in val2:
-					if values in pos_dict[words.lower()]:
-						pos_dict[words.lower()][values] += 1
-					else:
-						pos_dict[words.lower()][values] = 1
+def pos_encountered_disambiguation(alignments_with_voting, pos_dict=None):
+	if pos_dict is None:
+		pos_dict = pos_encountered(alignments_with_voting)
+		
+		# update pos_dict by using max_scores from alignments.
+		for sent in alignments_with_voting:
+			for words in alignments_with_voting[sent]:
+				val = alignments_with_voting[sent][words]
+				if len(val) >= 2:
+					val2 = return_maximal(val)
+					for values in val2:
+						if values in pos_dict[words.lower()]:
+							pos_dict[words.lower()][values] += occurrences[sent]
+						else:
+							pos_dict[words.lower()][values] = occurrences[sent]
 	
 	# traverse the alignments again, updating them in case of a new clear winner
 	# let it be, if otherwise.
@@ -454,28 +721,59 @@ def pos_encountered_disambiguation(alignments_with_voting):
 	return alignments_with_voting, pos_encountered(alignments_with_voting)
 
 
-# get a dict containing all the lemmas as the keys.
-# calls return_field_conllu() as defined before
-def get_lemma_based_tags(alignments_dict):
-	lemma_dict = defaultdict(dict)
+# returns a nested dict of [sentence][form] = lemma for the sentences in the input conllu file, read in a single pass.
+# as with index_blocks() and return_field_conllu(), the first block of a sentence and the first token of a form are kept.
+# only the sentences being tagged (in occurrences) are kept.
+# called in the main function, for tag_alignments() and sweep()
+def get_lemmas():
+	lemmas = new_dict()
 	with open(args.input, "r", encoding="utf-8") as infile:
-		contents = infile.readlines()
-		for lines in return_strings():
-			for words in alignments_dict[lines]:
-				lemma = return_field_conllu(find_str(lines, contents), "form", words, "lemma").lower()
-				if lemma != "_":
-					if len(alignments_dict[lines][words]) == 1:
-						pos = alignments_dict[lines][words][0]
-						if lemma in lemma_dict:
-							# if pos has been encountered before
-							if pos in lemma_dict[lemma]:
-								lemma_dict[lemma][pos] += 1
-							# in case of a new pos
-							else:
-								lemma_dict[lemma].update({pos: 1})
-						# if lemma is not in the final dict
+		sent = None
+		forms = dict()
+		for lines in infile:
+			if lines == "\n":
+				if sent is not None and sent in occurrences and sent not in lemmas:
+					lemmas[sent] = forms
+				sent = None
+				forms = dict()
+			elif lines[:3] == "# t" and sent is None:
+				sent = lines.strip("\n").split("# text = ")[1]
+			elif lines[:2] != "# " and sent is not None:
+				vals = lines.split("\t")
+				if vals[1] not in forms:
+					forms[vals[1]] = vals[2]
+		if sent is not None and sent in occurrences and sent not in lemmas:
+			lemmas[sent] = forms
+	return lemmas
+
+
+# returns the lemma of the word in the sentence, or the word itself if not found
+# called by get_lemma_based_tags(), fill_ambiguous(), fill_empty()
+def find_lemma(lemmas, sentence, word):
+	return lemmas[sentence].get(word, word)
+
+
+# get a dict containing all the lemmas as the keys.
+# each sentence is counted as many times as it occurs in the input file.
+# calls find_lemma() as defined before
+def get_lemma_based_tags(alignments_dict, lemmas):
+	lemma_dict = new_dict(dict)
+	for lines in occurrences:
+		for words in alignments_dict[lines]:
+			lemma = find_lemma(lemmas, lines, words).lower()
+			if lemma != "_":
+				if len(alignments_dict[lines][words]) == 1:
+					pos = alignments_dict[lines][words][0]
+					if lemma in lemma_dict:
+						# if pos has been encountered before
+						if pos in lemma_dict[lemma]:
+							lemma_dict[lemma][pos] += occurrences[lines]
+						# in case of a new pos
 						else:
-							lemma_dict[lemma] = {pos: 1}
+							lemma_dict[lemma].update({pos: occurrences[lines]})
+					# if lemma is not in the final dict
+					else:
+						lemma_dict[lemma] = {pos: occurrences[lines]}
 	return lemma_dict
 
 
@@ -553,101 +851,103 @@ def process_output(ip_sentence, token_details, alignments_data, pos_dict):
 	return write_as_str(new_details, "\t")
 
 
-# stores all the elements of the output conllu file in a list for direct printing
-# contains the final outputs
-# calls process_output_token()
-def write_output(alignments_data, pos_dict):
-	output_list = []
+# yields the elements of the output conllu file, in order
+# if sentence_range is given as (start, end), only the blocks of the sentences at these positions are yielded.
+# the outputs of a repeated sentence are memoized until its last occurrence, so that it is tagged once,
+# and only the outputs of the repeated sentences still to come are held.
+# calls index_blocks(), process_output(), report_memo()
+# called by write_output(), write_pipelined_output(), map_shard()
+def output_lines(alignments_data, pos_dict, sentence_range=None):
+	if sentence_range is None:
+		blocks = index_blocks(args.output)
+	else:
+		blocks = index_blocks(args.output, occurrences)
+	memo = dict()
+	# the number of occurrences left for each sentence in memo
+	left = dict()
+	lookups = 0
+	computed = 0
+	position = -1
+	in_range = sentence_range is None
+	# the comment lines of a block before its '# text =' line, kept until the position of the block is known
+	pending = []
+	seen_text = False
 	with open(args.output, "r", encoding="utf-8") as conllu_file:
-		contents = conllu_file.readlines()
-		for sentences in contents:
+		for sentences in conllu_file:
 			if sentences == "\n":
-				output_list.append(sentences)
+				if sentence_range is None:
+					for i in pending:
+						yield i
+				pending = []
+				if sentence_range is None or (seen_text and in_range):
+					yield sentences
+				seen_text = False
 			elif sentences[0] == "#":
-				output_list.append(sentences)
 				# extract the conllu block of this sentence, if of form '# text ='
 				if sentences[:3] == "# t":
-					sent = sentences.split("# text = ")[1].strip("\n")
-					conllu_block = find_str(sent, contents)
-					for token_details in conllu_block:
-						output_list.append(process_output(sent, token_details, alignments_data, pos_dict))
-	return output_list
+					position += 1
+					seen_text = True
+					in_range = sentence_range is None or sentence_range[0] <= position < sentence_range[1]
+					if in_range:
+						for i in pending:
+							yield i
+						yield sentences
+						sent = sentences.split("# text = ")[1].strip("\n")
+						lookups += 1
+						if sent in memo:
+							vals = memo[sent]
+						else:
+							vals = [process_output(sent, token_details, alignments_data, pos_dict) for token_details in blocks[sent]]
+							computed += 1
+							# only the repeated sentences are kept, until their last occurrence
+							if occurrences[sent] > 1:
+								memo[sent] = vals
+								left[sent] = occurrences[sent]
+						if sent in left:
+							left[sent] -= 1
+							if left[sent] == 0:
+								del memo[sent]
+								del left[sent]
+						for token_output in vals:
+							yield token_output
+					pending = []
+				elif seen_text:
+					if in_range:
+						yield sentences
+				else:
+					pending.append(sentences)
+	if sentence_range is None:
+		for i in pending:
+			yield i
+	report_memo("Output", lookups, computed)
 
 
-# main function
-if __name__ == "__main__":
-	# for keeping a track of weights, and the languages
-	scores = dict()
-	# for keeping a track of current directory
-	folder = args.input.split("/")[0]
-	# for keeping a track of the input file order
-	order = []
-	
-	scores, order = routine_checks(scores, order)
-	alignments_word = []
-	alignments_sentence = []
-	
-	if not args.already_pickled:
-		# the values are stored in the order of alignments, and so will be easier to manage.
-		for i in args.alignments:
-			alignments_sentence.append(sentence_alignments(i, folder))
-			alignments_word.append(word_alignments(i, folder))
-		
-		time_start = datetime.now()
-		alignments_sentence, alignments_word = get_projections(alignments_sentence, alignments_word)
-		
-		if args.pickle:
-			pickle.dump(alignments_sentence, open(folder + "/" + "sentence_pickle", "wb"))
-			pickle.dump(alignments_word, open(folder + "/" + "word_pickle", "wb"))
-			print("Pickles dumped in " + str(datetime.now() - time_start) + "\n\n\n")
-			exit(0)
-		else:
-			pass
-	else:
-		alignments_sentence = pickle.load(open(folder + "/" + args.already_pickled[0], "rb"))
-		alignments_word = pickle.load(open(folder + "/" + args.already_pickled[1], "rb"))
-	
-	# combine the different alignments from the different sources, and then add the scores.
-	alignments = set_scores(alignments_word, scores, order)
-	alignments = combine_projections(alignments)
-	alignments = combine_scores_dict_level(alignments)
-	
-	# Now, the alignments are ready in a single defaultdict.
-	# First, we vote for the most likely value, and save that, making the internal dict, as a dict of strings (POS).
-	# We save that in a different file, since we also need the alignment scores for unpopulated values.
-	alignments_final = decide_by_voting(alignments)
-	
-	# get a nested dict of all the words encountered with the counts of POS encountered in them.
-	# However, there are cases when a certain word might have equal number of maximal POS-tags encountered by voting.
-	# This needs to be dismbiguated, and is done by the function called here.
-	# Still, a few cases remain which will be taken care of next.
-	alignments_final, words_and_pos = pos_encountered_disambiguation(alignments_final)
-	
-	# End of VOTING ALIGNMENT
-	# Problems remaining:
-	# 1. Some of the words still have no clear-cut winner
-	# 2. A lot of the words don't have anything to start with, and need to be tagged from scratch.
-	
-	# For Problem 1
-	# Approach 1:
-	# From the most likely_contenders, select one at random and assign that POS tag.
-	# Approach 2:
-	# Same as in Problem 2
-	
-	# For Problem 2
-	# Approach 1:
-	# From the generated POS_list, populate what we can based on if there was an alignment earlier at some other point of time.
-	# Approach 2:
-	# Use lemmas of individual words, and assign the tag used as per the lemma of the current word.
-	# In case there are contenders, select one at random from the contendors.
-	
-	# We define each of the approaches in 2 different argument switches, and test accuracy with each.
-	
-	# PROBLEM 1
+# stores all the elements of the output conllu file in a list for direct printing
+# contains the final outputs
+# calls output_lines()
+def write_output(alignments_data, pos_dict):
+	return list(output_lines(alignments_data, pos_dict))
+
+
+# writes the output conllu file with '--pipeline', the tagging of the blocks overlapping with the writing.
+# the outputs are written as they are generated, without being kept in a list.
+# calls output_lines(), run_pipeline()
+def write_pipelined_output(alignments_data, pos_dict, ofile):
+	with open(ofile, "w", encoding="utf-8") as outfile:
+		run_pipeline(output_lines(alignments_data, pos_dict), outfile.write)
+
+
+# PROBLEM 1: fills in the words with more than one contender left after voting.
+# If '-rf' argument is given, one of the maximal contenders is selected at random.
+# Else, the most often tagged POS for the lemma is selected, resorting to the POS-dict for unknown lemmas.
+# if lemma_tags is not given, it is generated from the alignments.
+# returns the filled alignments, and the refreshed POS-dict
+# called by tag_alignments(), map_shard()
+def fill_ambiguous(alignments_final, words_and_pos, lemmas, report=True, lemma_tags=None):
+	time_start = datetime.now()
 	
 	# fill in the position with one of the random values from a multiple-option list
 	if args.random_fill:
-		time_start = datetime.now()
 		for sentences in alignments_final:
 			for words in alignments_final[sentences]:
 				val = alignments_final[sentences][words]
@@ -657,19 +957,17 @@ if __name__ == "__main__":
 					alignments_final[sentences][words] = val
 		# refresh the POS dict
 		words_and_pos = pos_encountered(alignments_final)
-		print("Time for random_selection based filling (part 1): " + str(datetime.now() - time_start))
-	
+		if report:
+			print("Time for random_selection based filling (part 1): " + str(datetime.now() - time_start))
 	
 	else:
-		time_start = datetime.now()
-		lemma_tags = get_lemma_based_tags(alignments_final)
-		infile = open(args.input, "r", encoding="utf-8")
-		contents = infile.readlines()
+		if lemma_tags is None:
+			lemma_tags = get_lemma_based_tags(alignments_final, lemmas)
 		for sentences in alignments_final:
 			for words in alignments_final[sentences]:
 				val = alignments_final[sentences][words]
 				if len(val) >= 2:
-					lemma = return_field_conllu(find_str(sentences, contents), "form", words, "lemma").lower()
+					lemma = find_lemma(lemmas, sentences, words).lower()
 					if lemma != "_":
 						if lemma in lemma_tags:
 							_, pos = remove_ambiguity(lemma, lemma_tags)
@@ -690,15 +988,26 @@ if __name__ == "__main__":
 		
 		# refresh the POS dict
 		words_and_pos = pos_encountered(alignments_final)
-		print("Time for lemma/form based filling (part 1): " + str(datetime.now() - time_start))
+		if report:
+			print("Time for lemma/form based filling (part 1): " + str(datetime.now() - time_start))
 	
-	# PROBLEM 2
+	return alignments_final, words_and_pos
+
+
+# PROBLEM 2: fills in the words without any contender.
+# If '-f' argument is given, the most often tagged POS for the lemma is selected.
+# Else, the value is filled from the POS-dict, if the word has been encountered before.
+# The values left empty are handled while writing the outputs.
+# if lemma_tags is not given, it is generated from the alignments.
+# returns the filled alignments, and the refreshed POS-dict
+# called by tag_alignments(), map_shard()
+def fill_empty(alignments_final, words_and_pos, lemmas, report=True, lemma_tags=None):
+	time_start = datetime.now()
+	total = 0
+	count = 0
 	
 	# fill in the position with an older possible value from the pos-dict
 	if not args.lemma_based_decision:
-		time_start = datetime.now()
-		total = 0
-		count = 0
 		for sentences in alignments_final:
 			for words in alignments_final[sentences]:
 				val = alignments_final[sentences][words]
@@ -721,26 +1030,21 @@ if __name__ == "__main__":
 					alignments_final[sentences][words] = val
 		
 		words_and_pos = pos_encountered(alignments_final)
-		print("Time for POS_based filling of blank values (part 2): " + str(datetime.now() - time_start))
-		if total != 0:
-			print(str(round((total - count) * 100 / total, 4)) + " % of originally_empty_values (" + str(total - count) + " of " + str(total) + ") remain unfilled.")
+		if report:
+			print("Time for POS_based filling of blank values (part 2): " + str(datetime.now() - time_start))
 	
 	# generate a dict of lemmas, and fill in the values based on the encountered lemmas.
 	# if a lemma is not present, it would be filled in later using POS_dict, updated after all the other values are filled in.
 	# the above mentioned step happens while writing the output file
 	else:
-		time_start = datetime.now()
-		lemma_tags = get_lemma_based_tags(alignments_final)
-		infile = open(args.input, "r", encoding="utf-8")
-		contents = infile.readlines()
-		total = 0
-		count = 0
+		if lemma_tags is None:
+			lemma_tags = get_lemma_based_tags(alignments_final, lemmas)
 		for sentences in alignments_final:
 			for words in alignments_final[sentences]:
 				val = alignments_final[sentences][words]
 				if len(val) == 0:
 					total += 1
-					lemma = return_field_conllu(find_str(sentences, contents), "form", words, "lemma")
+					lemma = find_lemma(lemmas, sentences, words)
 					
 					if lemma in lemma_tags:
 						single_count, max_vals = remove_ambiguity(lemma.lower(), lemma_tags)
@@ -759,16 +1063,625 @@ if __name__ == "__main__":
 		
 		# refresh the POS dict
 		words_and_pos = pos_encountered(alignments_final)
+		if report:
+			print("Time for Lemma_based filling of blank values (part 2): " + str(datetime.now() - time_start))
+	
+	if report and total != 0:
+		print(str(round((total - count) * 100 / total, 4)) + " % of originally_empty_values (" + str(total - count) + " of " + str(total) + ") remain unfilled.")
+	return alignments_final, words_and_pos
+
+
+# combine the different alignments from the different sources, adding the scores, a sentence at a time.
+# Once a sentence is combined, we vote for the most likely value, and save that, making the internal dict, as a dict of strings (POS).
+# The POS with the maximal scores are kept for unpopulated values.
+# returns the voted alignments, with the counts for pos_encountered_disambiguation() in case of '--pipeline' (else None)
+# calls merge_projections(), combine_scores(), decide_by_voting(), run_pipeline(), count_voted_sentence()
+# called by tag_alignments(), map_shard()
+def vote_alignments(word_alignments_dict, score_dict, order_dict):
+	state = new_dict(dict)
+	pos_dict = None
+	
+	def vote(item):
+		target_sent, words = item
+		for word in words:
+			words[word] = combine_scores(words[word])
+		return target_sent, decide_by_voting(words)
+	
+	# with '--pipeline', merging, voting and storing run concurrently, and the counts for the disambiguation are
+	# collected while storing, leaving only the updates for the second pass.
+	if args.pipeline:
+		pos_dict = new_dict(dict)
+		
+		def collect(item):
+			state[item[0]] = item[1]
+			count_voted_sentence(pos_dict, item[0], item[1])
+		
+		run_pipeline(merge_projections(word_alignments_dict, score_dict, order_dict), vote, collect)
+	else:
+		for item in merge_projections(word_alignments_dict, score_dict, order_dict):
+			target_sent, words = vote(item)
+			state[target_sent] = words
+	return state, pos_dict
+
+
+# tags the target sentences from the projections of all the sources, weighted as per score_dict.
+# returns the filled alignments with the POS-dict
+# if checkpoints is True, the state after each stage is saved.
+# if stage is given, the tagging continues after that stage from the state loaded by load_checkpoint().
+# calls vote_alignments(), pos_encountered_disambiguation(), fill_ambiguous() and fill_empty() as defined before.
+def tag_alignments(word_alignments_dict, score_dict, order_dict, lemmas, report=True, checkpoints=False, stage=-1, state=None):
+	pos_dict = None
+	if stage < 0:
+		state, pos_dict = vote_alignments(word_alignments_dict, score_dict, order_dict)
+		if checkpoints:
+			save_checkpoint(0, state)
+	
+	if stage < 1:
+		# get a nested dict of all the words encountered with the counts of POS encountered in them.
+		# However, there are cases when a certain word might have equal number of maximal POS-tags encountered by voting.
+		# This needs to be dismbiguated, and is done by the function called here.
+		# Still, a few cases remain which will be taken care of next.
+		state = pos_encountered_disambiguation(state, pos_dict)
+		if checkpoints:
+			save_checkpoint(1, state)
+	
+	# End of VOTING ALIGNMENT
+	# Problems remaining:
+	# 1. Some of the words still have no clear-cut winner
+	# 2. A lot of the words don't have anything to start with, and need to be tagged from scratch.
+	
+	# For Problem 1
+	# Approach 1:
+	# From the most likely_contenders, select one at random and assign that POS tag.
+	# Approach 2:
+	# Same as in Problem 2
+	
+	# For Problem 2
+	# Approach 1:
+	# From the generated POS_list, populate what we can based on if there was an alignment earlier at some other point of time.
+	# Approach 2:
+	# Use lemmas of individual words, and assign the tag used as per the lemma of the current word.
+	# In case there are contenders, select one at random from the contendors.
+	
+	# We define each of the approaches in 2 different argument switches, and test accuracy with each.
+	if stage < 2:
+		state = fill_ambiguous(state[0], state[1], lemmas, report)
+		if checkpoints:
+			save_checkpoint(2, state)
+	
+	if stage < 3:
+		state = fill_empty(state[0], state[1], lemmas, report)
+		if checkpoints:
+			save_checkpoint(3, state)
+	
+	return state
+
+
+# returns the key identifying the inputs and the arguments that the state after the stage depends upon.
+# the input files are identified by their path, size and modification time.
+# called by save_checkpoint(), load_checkpoint()
+def checkpoint_key(stage):
+	files = [args.input] + args.alignments + args.conllu
+	if args.lang_scores:
+		files += args.lang_scores
+	if args.already_pickled:
+		files += [folder + "/" + i for i in args.already_pickled]
+	vals = [CHECKPOINT_STAGES[stage]]
+	for i in files:
+		vals.append((i, os.path.getsize(i), os.path.getmtime(i)))
+	if stage >= 2:
+		vals.append(args.random_fill)
+	if stage >= 3:
+		vals.append(args.lemma_based_decision)
+	return hashlib.sha1(repr(vals).encode("utf-8")).hexdigest()
+
+
+# writes the objects in the file as gzipped pickles, one after the other.
+# a dict (or a store of '--store') is written as its length and default_factory, followed by its items one at a time,
+# so that read_pickles() can load it into new_dict() without having the whole of it in memory.
+# the file is written under a temporary name first, so that it is never left half-written.
+# called by save_checkpoint(), map_shard(), reduce_shards()
+def write_pickles(file_name, *objects):
+	with gzip.open(file_name + ".tmp", "wb", compresslevel=3) as outfile:
+		for i in objects:
+			if isinstance(i, (dict, DiskDict)):
+				pickle.dump(("dict", len(i), getattr(i, "default_factory", None)), outfile, pickle.HIGHEST_PROTOCOL)
+				for key in i:
+					pickle.dump((key, i[key]), outfile, pickle.HIGHEST_PROTOCOL)
+			else:
+				pickle.dump(("value", i), outfile, pickle.HIGHEST_PROTOCOL)
+	os.replace(file_name + ".tmp", file_name)
+
+
+# yields the given number of objects from the file written by write_pickles(), one at a time.
+# the dicts are loaded into new_dict(), an item at a time.
+# raises pickle.UnpicklingError if the file is not written by write_pickles()
+# called by load_checkpoint(), map_shard(), reduce_shards()
+def read_pickles(file_name, count):
+	with gzip.open(file_name, "rb") as infile:
+		for _ in range(count):
+			header = pickle.load(infile)
+			if not isinstance(header, tuple) or header[0] not in ["dict", "value"]:
+				raise pickle.UnpicklingError(file_name + " is not written by write_pickles()")
+			if header[0] == "value":
+				yield header[1]
+				continue
+			values = new_dict(header[2])
+			for _ in range(header[1]):
+				key, value = pickle.load(infile)
+				values[key] = value
+			yield values
+
+
+# saves the state after the stage in the folder as gzipped pickles, along with its key and the state of random.
+# the state after the first stage is the voted alignments, and after the rest, the alignments and the POS-dict.
+# called by tag_alignments()
+def save_checkpoint(stage, state):
+	time_start = datetime.now()
+	file_name = folder + "/" + "checkpoint_" + CHECKPOINT_STAGES[stage]
+	if stage == 0:
+		state = (state,)
+	write_pickles(file_name, checkpoint_key(stage), random.getstate(), *state)
+	print("Checkpoint " + file_name + " saved in " + str(datetime.now() - time_start))
+
+
+# returns the latest stage with a readable checkpoint matching the current inputs and arguments, and its state.
+# restores the state of random, so that the run continues as it would have without the interruption.
+# returns -1 and None if there is no such checkpoint
+def load_checkpoint():
+	for stage in range(len(CHECKPOINT_STAGES) - 1, -1, -1):
+		file_name = folder + "/" + "checkpoint_" + CHECKPOINT_STAGES[stage]
+		if not os.path.exists(file_name):
+			continue
+		try:
+			objects = read_pickles(file_name, 3 if stage == 0 else 4)
+			if next(objects) != checkpoint_key(stage):
+				continue
+			random_state = next(objects)
+			state = tuple(objects)
+			if stage == 0:
+				state = state[0]
+		except (OSError, EOFError, zlib.error, pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+			print("Skipping unreadable checkpoint " + file_name)
+			continue
+		random.setstate(random_state)
+		print("Resuming from checkpoint " + file_name)
+		return stage, state
+	print("No checkpoint matching the inputs found, starting from the alignments.")
+	return -1, None
+
+
+# returns the weight vectors to be tried by '--sweep', as dicts of [language] = normalized weight
+# grid: every combination of the weights 1/N, ..., 1 for each language, skipping the duplicates after normalization.
+# a weight of 0 is left out, since the candidates of a source weighted 0 are still voted upon, and do not drop the source.
+# random: N vectors of weights drawn uniformly
+# called by sweep()
+def sweep_weights(order_dict):
+	vals = []
+	if args.sweep == "grid":
+		seen = set()
+		for steps in itertools.product(range(1, args.sweep_size + 1), repeat=len(order_dict)):
+			weights = normalize_scores(dict(zip(order_dict, steps)))
+			key = tuple(round(weights[i], 6) for i in order_dict)
+			if key not in seen:
+				seen.add(key)
+				vals.append(weights)
+	else:
+		for _ in range(args.sweep_size):
+			vals.append(normalize_scores({i: random.random() for i in order_dict}))
+	return vals
+
+
+# returns the conllu blocks of the input file, as a list of (sentence, [token lines])
+# called by sweep()
+def get_gold_blocks():
+	vals = []
+	with open(args.input, "r", encoding="utf-8") as infile:
+		sent = None
+		block = []
+		for lines in infile:
+			if lines == "\n":
+				if sent is not None:
+					vals.append((sent, block))
+				sent = None
+				block = []
+			elif lines[:3] == "# t" and sent is None:
+				sent = lines.strip("\n").split("# text = ")[1]
+			elif sent is not None and lines[:2] != "# ":
+				block.append(lines.strip("\n"))
+		if sent is not None:
+			vals.append((sent, block))
+	return vals
+
+
+# returns the % of tokens in the gold blocks whose UPOS matches the output, as written by write_output()
+# calls process_output()
+# called by sweep()
+def sweep_accuracy(gold_blocks, alignments_data, pos_dict):
+	match = 0
+	total = 0
+	for sent, block in gold_blocks:
+		for token_details in block:
+			if process_output(sent, token_details, alignments_data, pos_dict).split("\t")[3] == token_details.split("\t")[3]:
+				match += 1
+			total += 1
+	return match * 100 / total
+
+
+# tags the data once for each weight vector of sweep_weights(), scoring the outputs against the UPOS of the input file.
+# the unweighted projections are kept in memory, and only the voting and the filling is repeated.
+# random is seeded the same for each weight vector, so that the random choices between tied tags
+# do not differ from one vector to the next, and the accuracies only differ by the weights.
+# calls sweep_weights(), get_gold_blocks(), tag_alignments(), sweep_accuracy()
+def sweep(word_alignments_dict, score_dict, order_dict, lemmas):
+	gold_blocks = get_gold_blocks()
+	evidence = [dict(i) for i in word_alignments_dict]
+	best = None
+	weight_list = [dict(score_dict)] + sweep_weights(order_dict)
+	seed = random.getrandbits(64)
+	for weights in weight_list:
+		time_start = datetime.now()
+		random.seed(seed)
+		alignments_final, words_and_pos = tag_alignments(evidence, weights, order_dict, lemmas, report=False)
+		accuracy = sweep_accuracy(gold_blocks, alignments_final, words_and_pos)
+		print("\t".join(i + "=" + str(round(weights[i], 4)) for i in order_dict) + "\t" + str(accuracy) + "\t" + str(datetime.now() - time_start))
+		if best is None or accuracy > best[1]:
+			best = (weights, accuracy)
+	print("\nBest:\t" + "\t".join(i + "=" + str(best[0][i]) for i in order_dict) + "\t" + str(best[1]))
+
+
+# projects the POS tags from the source block to the words of the target block, as done by get_projections()
+# a token is lost if it has no projected tag, or if its UPOS is not among the most often projected tags
+# returns the number of lost tokens, and the number of tokens
+# calls align_POS_from_conllu()
+# called by screen_pair()
+def screen_sentence(target_block, source_block, words):
+	lost = 0
+	total = 0
+	for token_details in target_block:
+		vals = token_details.split("\t")
+		if "-" in vals[0] or "." in vals[0]:
+			continue
+		total += 1
+		counts = defaultdict(int)
+		for pos in align_POS_from_conllu(source_block, words.get(vals[1], [])):
+			if pos is not None and pos != "_":
+				counts[pos] += 1
+		if len(counts) == 0 or counts.get(vals[3], 0) != max(counts.values()):
+			lost += 1
+	return lost, total
+
+
+# returns the estimated loss (in %) and the half-width of its confidence interval, from the per-sentence counts
+# the loss is a ratio of the lost tokens to all tokens, with the variance estimated over the sampled sentences
+# called by screen_pair()
+def loss_interval(sample):
+	n = len(sample)
+	lost = sum(i[0] for i in sample)
+	total = sum(i[1] for i in sample)
+	if n < 2 or total == 0:
+		return 100.0, 100.0
+	ratio = lost / total
+	mean_total = total / n
+	variance = sum((i[0] - ratio * i[1]) ** 2 for i in sample) / (n * (n - 1) * mean_total ** 2)
+	return ratio * 100, SCREEN_Z * variance ** 0.5 * 100
+
+
+# estimates the loss for the pair of '-i (--input)' language with the source of the alignment file.
+# the sentences are projected in random batches of '--screen_batch', until the confidence interval of the loss
+# is entirely above or below '--threshold', or '--screen_max' sentences have been seen.
+# returns the estimated loss, the half-width of the interval, and the number of sentences used
+# calls load_index(), indexed_triplets(), read_triplet(), index_blocks(), screen_sentence(), loss_interval()
+def screen_pair(alignment_file, language):
+	parallel_file = alignment_file.split("/")[0] + "/" + folder + "-" + alignment_file.split("/")[1].split("_")[0]
+	index = load_index(alignment_file, parallel_file)
+	
+	# with an index, only the sampled triplets are read
+	if index is not None:
+		total = len(index["sentences"])
+		picked = random.sample(range(total), min(total, args.screen_max))
+		triplets = list(indexed_triplets(alignment_file, parallel_file, index, picked))
+	else:
+		with open(parallel_file, "r", encoding="utf-8") as ifile:
+			parallel_data = ifile.readlines()
+		with open(alignment_file, "r", encoding="utf-8") as a_file:
+			contents = a_file.readlines()
+		picked = random.sample(range(len(contents) // 3), min(len(contents) // 3, args.screen_max))
+		triplets = [read_triplet(contents[3 * i:3 * i + 3], parallel_data) for i in picked]
+	target_blocks = index_blocks(args.input, set(i[0] for i in triplets))
+	source_blocks = index_blocks(folder + "/" + language + ".conllu", set(i[1] for i in triplets))
+	
+	sample = []
+	loss, half = 100.0, 100.0
+	for source, target, words in triplets:
+		if source in target_blocks and target in source_blocks:
+			sample.append(screen_sentence(target_blocks[source], source_blocks[target], words))
+			if len(sample) % args.screen_batch == 0:
+				loss, half = loss_interval(sample)
+				if loss - half > args.threshold or loss + half <= args.threshold:
+					return loss, half, len(sample)
+	loss, half = loss_interval(sample)
+	return loss, half, len(sample)
+
+
+# prints the estimated loss for each of the pairs, and if the pair would be dropped at '--threshold'
+# calls screen_pair()
+def screen(order_dict):
+	print("Pair\tLoss (in %)\tSentences\tDropped?\tTime")
+	for i in range(len(args.alignments)):
+		time_start = datetime.now()
+		loss, half, n = screen_pair(args.alignments[i], args.alignments[i].split("/")[1].split("_")[0])
+		if loss - half > args.threshold:
+			dropped = "Yes"
+		elif loss + half <= args.threshold:
+			dropped = "No"
+		else:
+			dropped = "Undecided"
+		print(folder + "-" + args.alignments[i].split("/")[1].split("_")[0] + "\t" + str(round(loss, 3)) + " +- " + str(round(half, 3)) + "\t" + str(n) + "\t" + dropped + "\t" + str(datetime.now() - time_start))
+
+
+# returns I and N of '--shard I/N'
+# called in the main function, and by map_shard()
+def shard_number():
+	try:
+		index, count = [int(i) for i in args.shard.split("/")]
+	except ValueError:
+		index, count = 0, 0
+	if not 1 <= index <= count:
+		print("\'--shard\' should be of the form I/N, with 1 <= I <= N.\n"
+			  "Check the argument, and try again.")
+		exit(1)
+	return index, count
+
+
+# returns the positions (start, end) of the sentences of the input file handled by shard I of N.
+# the shards take contiguous ranges, so that their outputs can be concatenated in order.
+# called in the main function, and by map_shard()
+def shard_range(index, count, total):
+	return (index - 1) * total // count, index * total // count
+
+
+# returns the directory shared by the shards, for the number of shards and the '-rf' and '-f' arguments
+# called by map_shard(), reduce_shards()
+def shard_directory(count):
+	return folder + "/" + "shards_" + str(count) + "_" + ("1" if args.random_fill else "0") + ("1" if args.lemma_based_decision else "0")
+
+
+# returns the projected word alignments of all the sources, for the sentences of the shard (in occurrences) only.
+# the alignment files are read a triplet at a time, seeking to the triplets of the shard with an index from merge_parts.py.
+# calls stored_alignments(), get_projections()
+# called by map_shard()
+def shard_projections():
+	return get_projections(*stored_alignments(occurrences))[1]
+
+
+# adds the counts of the nested dict table, as [key][POS] = count, to total
+# called by reduce_shards()
+def merge_counts(total, table):
+	for key in table:
+		for pos in table[key]:
+			if pos in total[key]:
+				total[key][pos] += table[key][pos]
+			else:
+				total[key][pos] = table[key][pos]
+
+
+# returns the (sentence, word) pairs of the alignments still without a single POS
+# called by map_shard()
+def undecided_tokens(alignments_data):
+	vals = []
+	for sent in alignments_data:
+		for words in alignments_data[sent]:
+			if len(alignments_data[sent][words]) != 1:
+				vals.append((sent, words))
+	return vals
+
+
+# runs the next round of the map step for the shard, as per SHARD_ROUNDS:
+# voted: projects and votes the sentences of the shard.
+# disambiguated, part1, part2: runs the stage of tag_alignments() with the count tables merged by '--reduce'.
+# each of these saves the alignments of the shard in 'map_I_round', and then the undecided tokens and the partial
+# count tables of the shard in 'tables_I_round', so that '--reduce' does not read the alignments.
+# output: writes the output of the shard, with the final count tables.
+# calls shard_number(), shard_directory(), shard_projections(), vote_alignments(), count_voted_sentence(),
+# pos_encountered_disambiguation(), fill_ambiguous(), fill_empty(), get_lemma_based_tags(), output_lines()
+def map_shard(score_dict, order_dict, lemmas, sentence_range):
+	index, count = shard_number()
+	directory = shard_directory(count)
+	os.makedirs(directory, exist_ok=True)
+	
+	stage = 0
+	while stage < len(SHARD_ROUNDS) - 1 and os.path.exists(directory + "/tables_" + str(index) + "_" + SHARD_ROUNDS[stage]):
+		stage += 1
+	time_start = datetime.now()
+	
+	if stage == 0:
+		state, _ = vote_alignments(shard_projections(), score_dict, order_dict)
+		pos_dict = new_dict(dict)
+		for sent in state:
+			count_voted_sentence(pos_dict, sent, state[sent])
+		tables = {"pos": pos_dict}
+	else:
+		reduced = directory + "/reduce_" + SHARD_ROUNDS[stage - 1]
+		if not os.path.exists(reduced):
+			print("The count tables of round \'" + SHARD_ROUNDS[stage - 1] + "\' have not been merged yet.\n"
+				  "Run \'--reduce " + str(count) + "\' once all the shards have finished the round, and try again.")
+			exit(1)
+		state = next(read_pickles(directory + "/map_" + str(index) + "_" + SHARD_ROUNDS[stage - 1], 1))
+		global_tables = dict(zip(["pos", "lemma"], read_pickles(reduced, 2)))
+		
+		if stage == 1:
+			state, pos_dict = pos_encountered_disambiguation(state, global_tables["pos"])
+			tables = {"pos": pos_dict}
+			if not args.random_fill:
+				tables["lemma"] = get_lemma_based_tags(state, lemmas)
+		elif stage == 2:
+			state, pos_dict = fill_ambiguous(state, global_tables["pos"], lemmas, lemma_tags=global_tables.get("lemma"))
+			tables = {"pos": pos_dict}
+			if args.lemma_based_decision:
+				tables["lemma"] = get_lemma_based_tags(state, lemmas)
+		elif stage == 3:
+			state, pos_dict = fill_empty(state, global_tables["pos"], lemmas, lemma_tags=global_tables.get("lemma"))
+			tables = {"pos": pos_dict}
+		elif not args.output:
+			print("\'-o (--output)\' is needed for the last round of the map step.\n"
+				  "Give the output file, and try again.")
+			exit(1)
+		else:
+			ofile = args.output + ("1" if args.random_fill else "0") + ("1" if args.lemma_based_decision else "0") + ".shard_" + str(index) + "_of_" + str(count)
+			with open(ofile, "w", encoding="utf-8") as outfile:
+				for i in output_lines(state, global_tables["pos"], sentence_range):
+					outfile.write(i)
+			print("Outputs of shard " + args.shard + " written in " + ofile + " in " + str(datetime.now() - time_start) + ".\n"
+				  "Concatenate the outputs of all the shards in order for the complete output.")
+			return
+	
+	write_pickles(directory + "/map_" + str(index) + "_" + SHARD_ROUNDS[stage], state)
+	# the lemma-based table is written as None for the rounds without one, so that the file holds 3 objects
+	write_pickles(directory + "/tables_" + str(index) + "_" + SHARD_ROUNDS[stage], undecided_tokens(state), tables["pos"], tables.get("lemma"))
+	print("Round \'" + SHARD_ROUNDS[stage] + "\' of shard " + args.shard + " done in " + str(datetime.now() - time_start) + ".")
+
+
+# merges the partial count tables of all the shards for the latest round finished by all of them,
+# and saves them for the next round of the map step.
+# only the tables of the shards are read, not their alignments.
+# calls shard_directory(), read_pickles(), merge_counts(), write_pickles()
+def reduce_shards():
+	if args.reduce < 1:
+		print("\'--reduce\' should be the number of shards, at least 1.\n"
+			  "Check the argument, and try again.")
+		exit(1)
+	directory = shard_directory(args.reduce)
+	for stage in range(len(SHARD_ROUNDS) - 2, -1, -1):
+		files = [directory + "/tables_" + str(i) + "_" + SHARD_ROUNDS[stage] for i in range(1, args.reduce + 1)]
+		found = [i for i in files if os.path.exists(i)]
+		if len(found) == 0:
+			continue
+		if len(found) != len(files):
+			print("Round \'" + SHARD_ROUNDS[stage] + "\' is not finished by all the shards. Missing:\n" + "\n".join(i for i in files if i not in found))
+			exit(1)
+		if os.path.exists(directory + "/reduce_" + SHARD_ROUNDS[stage]):
+			print("Round \'" + SHARD_ROUNDS[stage] + "\' has already been merged.")
+			exit(1)
+		time_start = datetime.now()
+		total = dict()
+		undecided = 0
+		for i in files:
+			tokens, *tables = read_pickles(i, 3)
+			undecided += len(tokens)
+			for name, table in zip(["pos", "lemma"], tables):
+				if table is None:
+					continue
+				if name not in total:
+					total[name] = new_dict(dict)
+				merge_counts(total[name], table)
+		write_pickles(directory + "/reduce_" + SHARD_ROUNDS[stage], total["pos"], total.get("lemma"))
+		print("Round \'" + SHARD_ROUNDS[stage] + "\' of " + str(args.reduce) + " shards merged in " + str(datetime.now() - time_start) + ", " + str(undecided) + " tokens undecided.")
+		return
+	print("No round of the map step found in " + directory + ".")
+	exit(1)
+
+
+# main function
+if __name__ == "__main__":
+	# for keeping a track of weights, and the languages
+	scores = dict()
+	# for keeping a track of current directory
+	folder = args.input.split("/")[0]
+	# for keeping a track of the input file order
+	order = []
+	# for keeping the recently used values of '--store' in memory
+	cache = None
+	if args.store:
+		cache = LRUCache(args.cache_mb * 1024 * 1024)
+	
+	scores, order = routine_checks(scores, order)
+	
+	if args.screen:
+		screen(order)
+		exit(0)
+	
+	if args.reduce is not None:
+		reduce_shards()
+		exit(0)
+	
+	# for keeping a track of the number of times each sentence occurs in the input file, in order
+	# with '--shard', only the sentences of the shard are kept
+	strings = return_strings()
+	sentence_range = None
+	if args.shard:
+		sentence_range = shard_range(*shard_number(), len(strings))
+		strings = strings[sentence_range[0]:sentence_range[1]]
+	occurrences = Counter(strings)
+	print(str(sum(occurrences.values())) + " sentences in the input, " + str(len(occurrences)) + " of them distinct.")
+	
+	if args.shard:
+		map_shard(scores, order, get_lemmas(), sentence_range)
+		exit(0)
+	
+	alignments_word = []
+	alignments_sentence = []
+	
+	# with a valid checkpoint, the alignments need not be generated or loaded again
+	stage = -1
+	state = None
+	if args.resume and not args.pickle and not args.sweep:
+		stage, state = load_checkpoint()
+	
+	if stage >= 0:
+		pass
+	elif not args.already_pickled:
+		time_start = datetime.now()
+		if args.pipeline:
+			alignments_sentence, alignments_word = pipelined_projections()
+		elif args.store:
+			# with '--store', the alignment files are read a triplet at a time, straight into the stores
+			alignments_sentence, alignments_word = stored_alignments()
+			time_start = datetime.now()
+			alignments_sentence, alignments_word = get_projections(alignments_sentence, alignments_word)
+		else:
+			# the values are stored in the order of alignments, and so will be easier to manage.
+			for i in args.alignments:
+				alignments_sentence.append(sentence_alignments(i, folder))
+				alignments_word.append(word_alignments(i, folder))
+			
+			time_start = datetime.now()
+			alignments_sentence, alignments_word = get_projections(alignments_sentence, alignments_word)
 		
-		print("Time for Lemma_based filling of blank values (part 2): " + str(datetime.now() - time_start))
-		if total != 0:
-			print(str(round((total - count) * 100 / total, 4)) + " % of originally_empty_values (" + str(total - count) + " of " + str(total) + ") remain unfilled.")
+		if args.pickle:
+			pickle.dump(alignments_sentence, open(folder + "/" + "sentence_pickle", "wb"))
+			pickle.dump(alignments_word, open(folder + "/" + "word_pickle", "wb"))
+			print("Pickles dumped in " + str(datetime.now() - time_start) + "\n\n\n")
+			exit(0)
+		else:
+			pass
+	else:
+		alignments_sentence = pickle.load(open(folder + "/" + args.already_pickled[0], "rb"))
+		alignments_word = pickle.load(open(folder + "/" + args.already_pickled[1], "rb"))
+		# with '--store', the loaded alignments are moved to the stores, so that the memory is freed for the tagging
+		if args.store:
+			alignments_sentence = [move_to_store(i) for i in alignments_sentence]
+			alignments_word = [move_to_store(i) for i in alignments_word]
+	
+	lemmas = get_lemmas()
+	
+	if args.sweep:
+		sweep(alignments_word, scores, order, lemmas)
+		exit(0)
+	
+	alignments_final, words_and_pos = tag_alignments(alignments_word, scores, order, lemmas, checkpoints=True, stage=stage, state=state)
 	
 	# In the end, for all remaining tokens, the rest of the tokens are given the POS_tag of "NOUN"
 	# this will be handled while reading the outputs for all the non-empty values.
 	
 	# Having filled in the alignments entirely, we substitute the values token-by-token in the output file
-	if args.output:
+	if args.output and args.pipeline:
+		time_start = datetime.now()
+		ofile = args.output + ("1" if args.random_fill else "0") + ("1" if args.lemma_based_decision else "0")
+		write_pipelined_output(alignments_final, words_and_pos, ofile)
+		print("Outputs calculated and written in " + ofile + " in " + str(datetime.now() - time_start))
+	
+	elif args.output:
 		print("Calculating Outputs now")
 		time_start = datetime.now()
 		outputs = write_output(alignments_final, words_and_pos)
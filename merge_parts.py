@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+
+import argparse
+import heapq
+import os
+import pickle
+from array import array
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-o", "--output", type=str, help="Merged alignments file. The index is written beside it, with \'.index\' appended", required=True)
+parser.add_argument("-p", "--parallel", type=str, help="Parallel data file the alignments were generated from, as TSV of target and source sentences", required=True)
+parser.add_argument("parts", type=str, nargs='+', help="mGiza part files (*.A3.final.part*), each sorted by the sentence number")
+args = parser.parse_args()
+
+
+# yields (sentence number, triplet) for the triplets of the mGiza part file, reading a triplet at a time.
+# raises ValueError if the sentence numbers of the part are not increasing, since the merge depends upon it.
+def read_part(part_file):
+	last = 0
+	with open(part_file, "rb") as infile:
+		triplet = []
+		for lines in infile:
+			triplet.append(lines)
+			if len(triplet) == 3:
+				number = int(triplet[0].split(b"(")[1].split(b")")[0])
+				if number <= last:
+					raise ValueError(part_file + " is not sorted by the sentence number (" + str(number) + " after " + str(last) + ").")
+				last = number
+				yield number, b"".join(triplet)
+				triplet = []
+
+
+# returns the offsets of the lines of the parallel data file
+def line_offsets(parallel_file):
+	offsets = array("q")
+	position = 0
+	with open(parallel_file, "rb") as infile:
+		for lines in infile:
+			offsets.append(position)
+			position += len(lines)
+	return offsets
+
+
+# writes the triplets of all the parts into the output file in the order of the sentence numbers.
+# the output file is left untouched if a part is not sorted.
+# returns the sentence numbers, and the offset of the triplet for each, in the output file.
+def merge_parts():
+	numbers = array("q")
+	offsets = array("q")
+	position = 0
+	try:
+		with open(args.output + ".tmp", "wb") as outfile:
+			for number, triplet in heapq.merge(*[read_part(i) for i in args.parts], key=lambda x: x[0]):
+				numbers.append(number)
+				offsets.append(position)
+				outfile.write(triplet)
+				position += len(triplet)
+	except ValueError as e:
+		os.remove(args.output + ".tmp")
+		print(str(e) + "\nCheck the part files, and try again.")
+		exit(1)
+	os.replace(args.output + ".tmp", args.output)
+	return numbers, offsets
+
+
+numbers, offsets = merge_parts()
+lines = line_offsets(args.parallel)
+if len(numbers) != 0 and numbers[-1] > len(lines):
+	print("Sentence " + str(numbers[-1]) + " is not found in " + args.parallel + ", with " + str(len(lines)) + " lines.\n"
+		  "Check the parallel data file, and try again.")
+	exit(1)
+
+# the sizes of both the files are kept, so that a stale index can be detected
+index = {"size": os.path.getsize(args.output),
+		 "parallel_size": os.path.getsize(args.parallel),
+		 "sentences": numbers,
+		 "offsets": offsets,
+		 "lines": lines}
+with open(args.output + ".index.tmp", "wb") as outfile:
+	pickle.dump(index, outfile, pickle.HIGHEST_PROTOCOL)
+os.replace(args.output + ".index.tmp", args.output + ".index")
+print(str(len(numbers)) + " triplets from " + str(len(args.parts)) + " parts merged in " + args.output + ", index written in " + args.output + ".index")
@@ -0,0 +1,178 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+# number of writes after which the pending SQLite transaction is committed
+COMMIT_EVERY = 10000
+# guards the shared cache and the stores, for the concurrent stages of align.py '--pipeline'
+LOCK = threading.RLock()
+
+
+# returns the length of the value, or None for values without one
+# called by LRUCache
+def value_length(value):
+	try:
+		return len(value)
+	except TypeError:
+		return None
+
+
+# Keeps the most recently used values of all the disk-backed dicts in memory, within a shared budget in bytes.
+# The size of a value is taken as its pickled size when it enters the cache. Since the callers update the values
+# (such as nested count dicts) in place, the size is measured again when a value is used after its length has changed.
+# Every cached value is treated as dirty, and is written back to its store when evicted.
+# The stores are held by weak references, so that a store dropped by its owner is closed and removed.
+class LRUCache:
+	def __init__(self, budget):
+		self.budget = budget
+		self.used = 0
+		self.entries = OrderedDict()
+
+	# returns the cached value for the key in store, or the given default.
+	# if the value has grown (or shrunk) in place since it was last measured, its size is refreshed.
+	def get(self, store, key, default=None):
+		slot = (id(store), key)
+		if slot in self.entries:
+			self.entries.move_to_end(slot)
+			ref, value, size, length = self.entries[slot]
+			if length != value_length(value):
+				new_size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+				self.entries[slot] = (ref, value, new_size, value_length(value))
+				self.used += new_size - size
+				self.evict()
+			return value
+		return default
+
+	def contains(self, store, key):
+		return (id(store), key) in self.entries
+
+	# adds the value to the cache, evicting the least recently used values when over budget.
+	def put(self, store, key, value, size):
+		slot = (id(store), key)
+		if slot in self.entries:
+			self.used -= self.entries[slot][2]
+		self.entries[slot] = (weakref.ref(store), value, size, value_length(value))
+		self.entries.move_to_end(slot)
+		self.used += size
+		self.evict()
+
+	# writes back and removes the least recently used values while over budget.
+	# the value used last is never evicted, so that it stays valid for the caller.
+	def evict(self):
+		while self.used > self.budget and len(self.entries) > 1:
+			(_, old_key), (old_store, old_value, old_size, _) = self.entries.popitem(last=False)
+			self.used -= old_size
+			if old_store() is not None:
+				old_store().write(old_key, old_value)
+
+	# removes the value from the cache, without writing it back
+	def drop(self, store, key):
+		slot = (id(store), key)
+		if slot in self.entries:
+			self.used -= self.entries.pop(slot)[2]
+
+	# removes all the values of the store from the cache, without writing them back
+	def discard(self, store):
+		for slot in [i for i in self.entries if i[0] == id(store)]:
+			self.used -= self.entries.pop(slot)[2]
+
+
+# A dict stored in a temporary SQLite file, with the recently used values kept in a shared LRUCache.
+# Keys and values are pickled. Iteration follows the order of insertion, as for a dict.
+# If default_factory is given, missing keys are created as in a defaultdict.
+# Pickling a DiskDict gives a plain dict, so that the pickles stay readable without the store.
+# The operations hold LOCK, so that the stores can be used from several threads.
+class DiskDict(MutableMapping):
+	def __init__(self, directory, cache, default_factory=None):
+		fd, self.path = tempfile.mkstemp(suffix=".sqlite", dir=directory)
+		os.close(fd)
+		self.cache = cache
+		self.default_factory = default_factory
+		self.writes = 0
+		self.db = sqlite3.connect(self.path, check_same_thread=False)
+		self.db.execute("PRAGMA journal_mode = OFF")
+		self.db.execute("PRAGMA synchronous = OFF")
+		self.db.execute("CREATE TABLE store (key BLOB PRIMARY KEY, value BLOB)")
+
+	# writes the value for the key to the disk, keeping the position of an existing key
+	def write(self, key, value):
+		blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		key_blob = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+		if self.db.execute("UPDATE store SET value = ? WHERE key = ?", (blob, key_blob)).rowcount == 0:
+			self.db.execute("INSERT INTO store (key, value) VALUES (?, ?)", (key_blob, blob))
+		self.writes += 1
+		if self.writes % COMMIT_EVERY == 0:
+			self.db.commit()
+		return blob
+
+	def __getitem__(self, key):
+		with LOCK:
+			value = self.cache.get(self, key, self)
+			if value is not self:
+				return value
+			row = self.db.execute("SELECT value FROM store WHERE key = ?", (pickle.dumps(key, pickle.HIGHEST_PROTOCOL),)).fetchone()
+			if row is None:
+				if self.default_factory is None:
+					raise KeyError(key)
+				value = self.default_factory()
+				self[key] = value
+				return value
+			value = pickle.loads(row[0])
+			self.cache.put(self, key, value, len(row[0]))
+			return value
+
+	def __setitem__(self, key, value):
+		with LOCK:
+			blob = self.write(key, value)
+			self.cache.put(self, key, value, len(blob))
+
+	def __delitem__(self, key):
+		with LOCK:
+			self.cache.drop(self, key)
+			if self.db.execute("DELETE FROM store WHERE key = ?", (pickle.dumps(key, pickle.HIGHEST_PROTOCOL),)).rowcount == 0:
+				raise KeyError(key)
+
+	def __contains__(self, key):
+		with LOCK:
+			if self.cache.contains(self, key):
+				return True
+			return self.db.execute("SELECT 1 FROM store WHERE key = ?", (pickle.dumps(key, pickle.HIGHEST_PROTOCOL),)).fetchone() is not None
+
+	# reads the keys in batches, so that the values can be updated while iterating
+	def __iter__(self):
+		last = 0
+		while True:
+			with LOCK:
+				rows = self.db.execute("SELECT rowid, key FROM store WHERE rowid > ? ORDER BY rowid LIMIT 1000", (last,)).fetchall()
+			if len(rows) == 0:
+				return
+			for rowid, key in rows:
+				yield pickle.loads(key)
+			last = rows[-1][0]
+
+	def __len__(self):
+		with LOCK:
+			return self.db.execute("SELECT COUNT(*) FROM store").fetchone()[0]
+
+	def __reduce__(self):
+		return dict, (), None, None, iter(self.items())
+
+	# drops the cached values and removes the file from the disk
+	def close(self):
+		with LOCK:
+			if self.db is not None:
+				self.cache.discard(self)
+				self.db.close()
+				self.db = None
+				os.remove(self.path)
+
+	def __del__(self):
+		try:
+			self.close()
+		except (AttributeError, TypeError, OSError, sqlite3.Error):
+			pass